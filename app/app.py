@@ -2,7 +2,7 @@
 app.py
 
 Created on 2021-11-16
-Updated on 2022-02-06
+Updated on 2026-10-15
 
 Copyright © Ryan Kan
 
@@ -16,16 +16,25 @@ import re
 import shutil
 import threading
 from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import Manager
+from multiprocessing.managers import SyncManager
+from typing import Optional, Tuple
 
 import yaml
 from flask import Flask, render_template, request, redirect, url_for, flash, send_file, send_from_directory, abort
 from pydub import AudioSegment
 from pydub.exceptions import CouldntDecodeError
 
+try:  # Use the much faster libyaml bindings if PyYAML was built with them
+    from yaml import CSafeLoader as YAMLLoader, CSafeDumper as YAMLDumper
+except ImportError:
+    from yaml import SafeLoader as YAMLLoader, SafeDumper as YAMLDumper
+
 from src.audio import estimate_bpm, get_audio_length, samples_to_vqt
-from src.hashing import generate_hash_from_file
-from src.io import audio_to_audiosegment, audiosegment_to_mp3, audiosegment_to_wav, wav_to_samples, \
-    SUPPORTED_AUDIO_EXTENSIONS
+from src.hashing import generate_hash_from_stream, generate_random_hash
+from src.io import audio_to_audiosegment, audiosegment_to_mp3, audiosegment_to_samples, SUPPORTED_AUDIO_EXTENSIONS
 from src.misc import MUSIC_KEYS, NOTE_NUMBER_RANGE
 from src.visuals import generate_spectrogram_img
 
@@ -33,12 +42,19 @@ from src.visuals import generate_spectrogram_img
 # File constants
 MAX_AUDIO_FILE_SIZE = {"Value": 10 ** 7, "Name": "10 MB"}
 ACCEPTED_FILE_TYPES = [x.upper()[1:] for x in SUPPORTED_AUDIO_EXTENSIONS.keys()] + ["AUTR"]
+ACCEPTED_FILE_TYPES_SET = frozenset(ACCEPTED_FILE_TYPES)  # For fast membership checks
+CBR_SUFFIX_REGEX = re.compile(r"_cbr(?!.*_cbr)+")  # Matches the last `_cbr` in a file name
 CBR_MP3_BITRATE = 192  # In thousands
 
 # Spectrogram settings
 BATCH_SIZE = 32
 PX_PER_SECOND = 120  # Number of pixels of the spectrogram dedicated to each second of audio
 SPECTROGRAM_HEIGHT = 720  # Height of the spectrogram, in pixels
+SPECTROGRAM_COMPRESS_LEVEL = 1  # zlib compression level of the spectrogram PNG; favours speed over file size
+
+# Processing settings
+PROCESSING_WORKERS = max(2, os.cpu_count() // 2)  # Number of files that can be processed at once
+THREADS_PER_WORKER = max(1, os.cpu_count() // PROCESSING_WORKERS)  # Share of the CPUs given to each file's processing
 
 # Music settings
 BEATS_PER_BAR_RANGE = [1, 8]  # In the format [min, max]
@@ -68,10 +84,39 @@ except OSError:
 # GLOBAL VARIABLES
 processingThreads = defaultdict(lambda: {"phase": 0, "progress": []})
 
+processingManager: Optional[SyncManager] = None  # Created on first use so that importing the app starts no processes
+processingExecutor: Optional[ProcessPoolExecutor] = None
+processingPoolLock = threading.Lock()
+
 
 # HELPER FUNCTIONS
 def allowed_file(filename: str):
-    return "." in filename and filename.rsplit(".", 1)[1].upper() in ACCEPTED_FILE_TYPES
+    return "." in filename and filename.rsplit(".", 1)[1].upper() in ACCEPTED_FILE_TYPES_SET
+
+
+def get_processing_pool(
+        broken_executor: Optional[ProcessPoolExecutor] = None) -> Tuple[SyncManager, ProcessPoolExecutor]:
+    global processingManager, processingExecutor
+
+    with processingPoolLock:
+        # Create the manager on first use
+        if processingManager is None:
+            processingManager = Manager()
+
+        # Create the executor on first use, or replace it if it is the broken one (and no one has replaced it yet)
+        if processingExecutor is None or processingExecutor is broken_executor:
+            if broken_executor is not None:
+                broken_executor.shutdown(wait=False)
+
+            processingExecutor = ProcessPoolExecutor(max_workers=PROCESSING_WORKERS)
+
+    return processingManager, processingExecutor
+
+
+def report_processing_error(future: Future):
+    # Errors raised in the worker process are otherwise silently kept by the future
+    if future.exception() is not None:
+        app.logger.error("Processing of an uploaded file failed.", exc_info=future.exception())
 
 
 def processing_file(file: str, uuid: str, thread_data: dict):
@@ -79,22 +124,14 @@ def processing_file(file: str, uuid: str, thread_data: dict):
     folder_path = os.path.join(app.config["UPLOAD_FOLDER"], uuid)
 
     # Split the file into its filename and extension
-    filename, extension = os.path.splitext(file)
+    filename, _ = os.path.splitext(file)
 
     # Convert the audio file into an `AudioSegment` object
     thread_data["phase"] = 1  # Converting to audio segment
     audiosegment = audio_to_audiosegment(os.path.join(folder_path, file))
 
-    # If the file is not a WAV file then convert it into one
-    thread_data["phase"] = 2  # Generating WAV file
-    if extension[1:].upper() != "WAV":
-        audiosegment_to_wav(audiosegment, os.path.join(folder_path, filename))
-        file_wav = os.path.join(folder_path, filename + ".wav")
-    else:
-        file_wav = os.path.join(folder_path, file)
-
     # Convert the audio file into a CBR MP3
-    thread_data["phase"] = 3  # Generating CBR MP3
+    thread_data["phase"] = 2  # Generating CBR MP3
     audiosegment_to_mp3(audiosegment, os.path.join(folder_path, filename + "_cbr"), bitrate=CBR_MP3_BITRATE)
 
     # Update the status file on the audio file to reference
@@ -103,36 +140,37 @@ def processing_file(file: str, uuid: str, thread_data: dict):
         audio_file_name=filename + "_cbr.mp3"
     )
 
-    # Now split the WAV file into samples
-    thread_data["phase"] = 4  # Splitting into samples
-    samples, sample_rate = wav_to_samples(file_wav)
+    # Now get the samples straight from the audio segment
+    thread_data["phase"] = 3  # Splitting into samples
+    samples, sample_rate = audiosegment_to_samples(audiosegment)
 
-    # We can now delete the old file and the WAV file
-    try:
-        os.remove(os.path.join(folder_path, file))
-        os.remove(file_wav)
-    except OSError:  # The files may be one and the same
-        pass
+    # We can now delete the old file
+    os.remove(os.path.join(folder_path, file))
 
     # Calculate the duration of the audio
     duration = get_audio_length(samples, sample_rate)
 
-    # Convert the samples into a spectrogram
-    thread_data["phase"] = 5  # Generating VQT data
-    spectrogram, frequencies, times = samples_to_vqt(sample_rate, samples)
+    # Start estimating the BPM of the sample; it does not depend on the spectrogram, so it runs alongside it
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        bpm_future = executor.submit(estimate_bpm, samples, sample_rate)
+
+        # Convert the samples into a spectrogram
+        thread_data["phase"] = 4  # Generating VQT data
+        spectrogram, frequencies, times = samples_to_vqt(sample_rate, samples, workers=THREADS_PER_WORKER)
 
-    # Convert the spectrogram data into a spectrogram image
-    thread_data["phase"] = 6  # Generating spectrogram image
-    image = generate_spectrogram_img(spectrogram, frequencies, times, duration, progress=thread_data["progress"],
-                                     batch_size=BATCH_SIZE, px_per_second=PX_PER_SECOND, img_height=SPECTROGRAM_HEIGHT)
+        # Convert the spectrogram data into a spectrogram image
+        thread_data["phase"] = 5  # Generating spectrogram image
+        image = generate_spectrogram_img(spectrogram, frequencies, times, duration, progress=thread_data["progress"],
+                                         batch_size=BATCH_SIZE, px_per_second=PX_PER_SECOND,
+                                         img_height=SPECTROGRAM_HEIGHT, workers=THREADS_PER_WORKER)
 
-    # Save the image
-    thread_data["phase"] = 7  # Saving spectrogram image
-    image.save(os.path.join(folder_path, f"{filename}.png"))
+        # Save the image
+        thread_data["phase"] = 6  # Saving spectrogram image
+        image.save(os.path.join(folder_path, f"{filename}.png"), compress_level=SPECTROGRAM_COMPRESS_LEVEL)
 
-    # Estimate the BPM of the sample
-    thread_data["phase"] = 8  # Final touches
-    bpm = int(estimate_bpm(samples, sample_rate)[0])  # Todo: support dynamic BPM
+        # Wait for the BPM estimate
+        thread_data["phase"] = 7  # Final touches
+        bpm = int(bpm_future.result()[0])  # Todo: support dynamic BPM
 
     # Update status file
     update_status_file(
@@ -142,13 +180,13 @@ def processing_file(file: str, uuid: str, thread_data: dict):
         duration=duration,
         spectrogram_generated=True
     )
-    thread_data["phase"] = 9  # Everything done
+    thread_data["phase"] = 8  # Everything done
 
 
 def update_status_file(status_file: str, **status_updates):
     # Load current status from file
     with open(status_file, "r") as f:
-        status = yaml.load(f, yaml.Loader)
+        status = yaml.load(f, YAMLLoader)
 
     # Update status
     for key, value in status_updates.items():
@@ -156,7 +194,7 @@ def update_status_file(status_file: str, **status_updates):
 
     # Dump updated status back to file
     with open(status_file, "w") as f:
-        yaml.dump(status, f)
+        yaml.dump(status, f, Dumper=YAMLDumper)
 
 
 # FOLDER PATHS
@@ -220,15 +258,13 @@ def query_process(uuid):
         return_data = {"Message": "Starting to process spectrogram."}
     elif phase == 1:  # Converting to audio segment
         return_data = {"Message": "Converting to audio segment data."}
-    elif phase == 2:  # Generating WAV file
-        return_data = {"Message": "Generating WAV file."}
-    elif phase == 3:  # Generating CBR MP3
+    elif phase == 2:  # Generating CBR MP3
         return_data = {"Message": "Generating constant bitrate MP3 file."}
-    elif phase == 4:  # Splitting into samples
+    elif phase == 3:  # Splitting into samples
         return_data = {"Message": "Splitting audio into smaller samples."}
-    elif phase == 5:  # Generating VQT data
+    elif phase == 4:  # Generating VQT data
         return_data = {"Message": "Generating spectrogram data."}
-    elif phase == 6:  # Generating spectrogram image
+    elif phase == 5:  # Generating spectrogram image
         # Get the latest value in the progress
         if progress[0] is None:  # Nothing processed yet
             batch_no = 0
@@ -241,11 +277,11 @@ def query_process(uuid):
 
         # Generate the return data
         return_data = {"Message": "Generating spectrogram image.", "Progress": progress_percentage}
-    elif phase == 7:  # Saving spectrogram image
+    elif phase == 6:  # Saving spectrogram image
         return_data = {"Message": "Saving spectrogram image."}
-    elif phase == 8:  # Final touches
+    elif phase == 7:  # Final touches
         return_data = {"Message": "Performing final touches."}
-    else:  # Phase 9; updated status file
+    else:  # Phase 8; updated status file
         return_data = {"Message": "Updated status file. Redirecting in a short while...", "Progress": 100}
 
     return json.dumps(return_data)
@@ -290,7 +326,7 @@ def upload_file():
     # Check if this is an existing project file
     if os.path.splitext(file.filename)[-1].upper() == ".AUTR":
         # Read the contents of the .autr file as an YAML file
-        existing_project = yaml.load(file.stream, yaml.Loader)
+        existing_project = yaml.load(file.stream, YAMLLoader)
 
         # Get the UUID
         existing_uuid = existing_project["uuid"]
@@ -302,12 +338,9 @@ def upload_file():
             "url": url_for("transcriber", uuid=existing_uuid)
         })
 
-    # If not existing project, save the file
-    initial_file_path = os.path.join(app.config["UPLOAD_FOLDER"], file.filename)
-    file.save(initial_file_path)
-
-    # Generate the file's UUID based on its contents
-    uuid = generate_hash_from_file(initial_file_path)
+    # If not existing project, save the file to a temporary location while generating its UUID based on its contents
+    initial_file_path = os.path.join(app.config["UPLOAD_FOLDER"], generate_random_hash())
+    uuid = generate_hash_from_stream(file.stream, initial_file_path)
 
     # Check if a UUID like that already exists
     try:
@@ -326,7 +359,7 @@ def upload_file():
 
     # If it is not an existing file, move the file into the created directory
     final_file_path = os.path.join(folder_path, file.filename)
-    shutil.move(initial_file_path, final_file_path)
+    os.rename(initial_file_path, final_file_path)  # Same file system, so this does not copy the file
 
     # Get the file's extension
     _, extension = os.path.splitext(file.filename)
@@ -355,7 +388,7 @@ def upload_file():
 
     # Create a status file
     with open(os.path.join(folder_path, "status.yaml"), "w") as f:
-        yaml.dump(status_blank, f)
+        yaml.dump(status_blank, f, Dumper=YAMLDumper)
 
     # Provide the link to another page for the analysis of that audio file
     return json.dumps({
@@ -389,20 +422,27 @@ def transcriber(uuid):
 
     # Read the status file
     with open(os.path.join(folder_path, "status.yaml"), "r") as f:
-        status = yaml.load(f, yaml.Loader)
+        status = yaml.load(f, YAMLLoader)
 
     # Check whether the CBR MP3 file was created yet
     audio_file_name = status["audio_file_name"]
 
     if audio_file_name is None:  # CBR MP3 not yet created
-        # Create a location to store the spectrogram generation progress
-        processingThreads[uuid]["progress"].append(None)  # One-element list for data sharing
+        # Create a location to store the processing status that the worker process can update
+        manager, executor = get_processing_pool()
+        processingThreads[uuid] = manager.dict({
+            "phase": 0,
+            "progress": manager.list([None])  # One-element list for data sharing
+        })
 
-        # Start a multiprocessing thread and save it to the master dictionary
-        thread = threading.Thread(target=processing_file,
-                                  args=(status["original_file_name"], uuid, processingThreads[uuid]))
-        thread.start()
-        processingThreads[uuid]["thread"] = thread
+        # Process the file in a separate process, so that it does not compete with the app for the GIL
+        try:
+            future = executor.submit(processing_file, status["original_file_name"], uuid, processingThreads[uuid])
+        except BrokenProcessPool:
+            # A worker died abruptly (e.g. killed for running out of memory), which breaks the whole pool; replace it
+            _, executor = get_processing_pool(broken_executor=executor)
+            future = executor.submit(processing_file, status["original_file_name"], uuid, processingThreads[uuid])
+        future.add_done_callback(report_processing_error)
 
         # Render the template
         return render_template("transcriber.html", spectrogram_generated=False, uuid=uuid,
@@ -415,7 +455,7 @@ def transcriber(uuid):
             # Render the template
             return render_template("transcriber.html", spectrogram_generated=False, uuid=uuid,
                                    file_name=status["audio_file_name"],
-                                   file_name_proper=re.sub(r"_cbr(?!.*_cbr)+", "", status["audio_file_name"]))
+                                   file_name_proper=CBR_SUFFIX_REGEX.sub("", status["audio_file_name"]))
         else:
             # Try and delete the process thread
             if processingThreads[uuid]:
@@ -424,7 +464,7 @@ def transcriber(uuid):
             # Render the template with the variables
             return render_template("transcriber.html", spectrogram_generated=True, uuid=uuid,
                                    file_name=status["audio_file_name"],
-                                   file_name_proper=re.sub(r"_cbr(?!.*_cbr)+", "", status["audio_file_name"]),
+                                   file_name_proper=CBR_SUFFIX_REGEX.sub("", status["audio_file_name"]),
                                    status=json.dumps(status), beats_per_bar_range=BEATS_PER_BAR_RANGE,
                                    bpm_range=BPM_RANGE, music_keys=MUSIC_KEYS, note_number_range=NOTE_NUMBER_RANGE,
                                    px_per_second=PX_PER_SECOND)
@@ -2,7 +2,7 @@
 main.py
 
 Created on 2021-11-16
-Updated on 2022-02-06
+Updated on 2026-10-15
 
 Copyright © Ryan Kan
 
@@ -15,8 +15,9 @@ import webbrowser
 from app import app
 
 # MAIN CODE
-# Open a new browser window with the url
-webbrowser.open("http://127.0.0.1:5000/", new=1)  # Fixme: possible URL not found due to race condition with below code
+if __name__ == "__main__":  # Needed as the app's worker processes may re-import this module
+    # Open a new browser window with the url
+    webbrowser.open("http://127.0.0.1:5000/", new=1)  # Fixme: possible URL not found due to race condition with below
 
-# Run the main app
-app.run(threaded=True)
+    # Run the main app
+    app.run(threaded=True)
@@ -1,2 +1,12 @@
+import librosa
+import scipy.fft
+
+from .amplitude_to_db import amplitude_to_db
+from .get_bin_frequencies import get_bin_frequencies
 from .samples_to_cqt import samples_to_cqt
 from .samples_to_vqt import samples_to_vqt
+
+# Make librosa use `scipy`'s pocketfft instead of `numpy.fft`. It keeps single precision and can split each FFT across
+# threads (see `scipy.fft.set_workers`). NOTE: this is process-wide, so it applies to ALL librosa calls, including
+# those made by `estimate_bpm`.
+librosa.set_fftlib(scipy.fft)
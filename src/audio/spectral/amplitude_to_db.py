@@ -0,0 +1,51 @@
+"""
+amplitude_to_db.py
+
+Created on 2026-10-15
+Updated on 2026-10-15
+
+Copyright © Ryan Kan
+
+Description: Converts an amplitude spectrogram into a decibel spectrogram.
+"""
+
+# IMPORTS
+import numpy as np
+
+# CONSTANTS
+AMIN = 1e-5  # Minimum amplitude, to avoid taking the logarithm of zero
+
+
+# FUNCTIONS
+def amplitude_to_db(spectrogram: np.ndarray, top_db: float = 80.) -> np.ndarray:
+    """
+    Converts an amplitude spectrogram into decibels, relative to the largest amplitude in the spectrogram.
+
+    This gives the same result as `librosa.amplitude_to_db(spectrogram, ref=np.max, top_db=top_db)`, but the conversion
+    is done IN PLACE so that no temporary arrays of the spectrogram's size are created.
+
+    Args:
+        spectrogram:
+            Matrix of (non-negative) amplitudes. This is overwritten with the result.
+
+        top_db:
+            Threshold (in decibels) below the peak. Any values quieter than this are clipped to it.
+
+    Returns:
+        np.ndarray:
+            The decibel spectrogram. This is the same array object as `spectrogram`.
+    """
+
+    # Get the reference amplitude
+    ref = max(np.amax(spectrogram), AMIN)
+
+    # Convert the amplitudes into decibels relative to the reference
+    np.maximum(spectrogram, AMIN, out=spectrogram)
+    spectrogram /= ref
+    np.log10(spectrogram, out=spectrogram)
+    spectrogram *= 20
+
+    # The peak is at 0 dB, so clip everything below `-top_db`
+    np.maximum(spectrogram, -top_db, out=spectrogram)
+
+    return spectrogram
@@ -0,0 +1,49 @@
+"""
+get_bin_frequencies.py
+
+Created on 2026-10-15
+Updated on 2026-10-15
+
+Copyright © Ryan Kan
+
+Description: Gets the centre frequencies of the bins of a constant-Q or variable-Q transform.
+"""
+
+# IMPORTS
+from functools import lru_cache
+
+import librosa
+import numpy as np
+
+
+# FUNCTIONS
+@lru_cache(maxsize=8)
+def get_bin_frequencies(n_bins: int, f_min: float, bins_per_octave: int) -> np.ndarray:
+    """
+    Gets the centre frequencies of the bins of a CQT or VQT.
+
+    The result only depends on the arguments, so it is cached. The returned array is read-only as it is shared between
+    calls.
+
+    Args:
+        n_bins:
+            Number of frequency bins starting from `f_min`.
+
+        f_min:
+            Minimum frequency.
+
+        bins_per_octave:
+            Number of frequency bins dedicated to each octave.
+
+    Returns:
+        np.ndarray:
+            Array of the centre frequencies of the bins.
+    """
+
+    # Calculate the frequencies of the bins
+    frequencies = librosa.cqt_frequencies(n_bins, f_min, bins_per_octave=bins_per_octave)
+
+    # Prevent callers from modifying the cached array
+    frequencies.flags.writeable = False
+
+    return frequencies
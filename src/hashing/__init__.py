@@ -1,2 +1,2 @@
-from .file_hash import generate_hash_from_file
+from .file_hash import generate_hash_from_file, generate_hash_from_stream
 from .random_hash import generate_random_hash
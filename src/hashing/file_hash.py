@@ -2,7 +2,7 @@
 generate_hash_from_file.py
 
 Created on 2022-01-22
-Updated on 2022-02-02
+Updated on 2026-10-15
 
 Copyright © Ryan Kan
 
@@ -10,7 +10,12 @@ Description: Generates a SHA hash based on file contents.
 """
 
 # IMPORTS
+import hashlib
 from hashlib import sha1
+from typing import BinaryIO
+
+# CONSTANTS
+BLOCK_SIZE = 2 ** 16  # Number of bytes to read at a time; 64 KiB
 
 
 # FUNCTIONS
@@ -27,19 +32,56 @@ def generate_hash_from_file(file_path: str) -> str:
             The SHA1 hash of the file.
     """
 
-    # Define hash object
-    sha_hash = sha1()
-
     # Read file bytes
     with open(file_path, "rb") as f:
-        # Read and update hash string value in blocks of 8 KiB
-        for byte_block in iter(lambda: f.read(8192), b""):  # The sentinel value is a null byte
+        # Let `hashlib` read the file into a reused buffer, where available (Python 3.11+)
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, sha1).hexdigest()
+
+        # Define hash object
+        sha_hash = sha1()
+
+        # Read and update hash string value in blocks of `BLOCK_SIZE` bytes
+        for byte_block in iter(lambda: f.read(BLOCK_SIZE), b""):  # The sentinel value is a null byte
             sha_hash.update(byte_block)
 
     # Output the hex digest of the file
     return sha_hash.hexdigest()
 
 
+def generate_hash_from_stream(stream: BinaryIO, file_path: str) -> str:
+    """
+    Generates a SHA hash based on the contents of `stream`, while saving those contents to the file at `file_path`.
+
+    The hash is the same as what `generate_hash_from_file` gives for the saved file, but the contents are only read
+    once.
+
+    Args:
+        stream:
+            Binary stream to read from.
+
+        file_path:
+            Path to save the contents of the stream to.
+
+    Returns:
+        str:
+            The SHA1 hash of the stream's contents.
+    """
+
+    # Define hash object
+    sha_hash = sha1()
+
+    # Copy the stream into the file
+    with open(file_path, "wb") as f:
+        # Update hash string value with each block of `BLOCK_SIZE` bytes as it is written
+        for byte_block in iter(lambda: stream.read(BLOCK_SIZE), b""):  # The sentinel value is a null byte
+            sha_hash.update(byte_block)
+            f.write(byte_block)
+
+    # Output the hex digest of the stream
+    return sha_hash.hexdigest()
+
+
 # TESTING CODE
 if __name__ == "__main__":
     print(generate_hash_from_file("file_hash.py"))  # Generate file hash of itself
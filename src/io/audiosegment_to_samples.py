@@ -0,0 +1,49 @@
+"""
+audiosegment_to_samples.py
+
+Created on 2026-10-15
+Updated on 2026-10-15
+
+Copyright © Ryan Kan
+
+Description: Gets the samples and sample rate of an `AudioSegment` object.
+"""
+
+# IMPORTS
+from typing import Tuple
+
+import numpy as np
+from pydub import AudioSegment
+
+# CONSTANTS
+SAMPLE_WIDTH_TO_DTYPE = {1: np.int8, 2: np.int16, 4: np.int32}  # Pydub stores samples as signed integers
+
+
+# FUNCTIONS
+def audiosegment_to_samples(audiosegment: AudioSegment) -> Tuple[np.ndarray, int]:
+    """
+    Gets the samples and sample rate of an `AudioSegment` object.
+
+    The samples are mixed down to mono and scaled into the interval [-1, 1], which matches what `wav_to_samples` returns
+    for the same audio.
+
+    Args:
+        audiosegment:
+            The `AudioSegment` object.
+
+    Returns:
+        Tuple[np.ndarray, int]:
+            Double containing the audio samples and the sample rate in that order.
+    """
+
+    # Read the raw PCM data of the audio segment as integers, with one column per channel
+    samples = np.frombuffer(audiosegment.raw_data, dtype=SAMPLE_WIDTH_TO_DTYPE[audiosegment.sample_width])
+    samples = samples.reshape(-1, audiosegment.channels)
+
+    # Mix the channels down to mono
+    samples = samples.mean(axis=1, dtype=np.float32)
+
+    # Scale the samples into the interval [-1, 1]
+    samples /= 2 ** (8 * audiosegment.sample_width - 1)
+
+    return samples, audiosegment.frame_rate
@@ -2,7 +2,7 @@
 audiosegment_to_wav.py
 
 Created on 2021-11-16
-Updated on 2022-02-02
+Updated on 2026-10-15
 
 Copyright © Ryan Kan
 
@@ -10,6 +10,9 @@ Description: Converts an audio file to a WAV file.
 """
 
 # IMPORTS
+import wave
+
+import numpy as np
 from pydub import AudioSegment
 
 
@@ -27,4 +30,16 @@ def audiosegment_to_wav(audiosegment: AudioSegment, filename: str):
             This is JUST THE FILE NAME, without the extension of the file.
     """
 
-    audiosegment.export(f"{filename}.wav", format="wav")
+    # Get the raw PCM data of the audio segment
+    pcm_data = audiosegment.raw_data
+
+    if audiosegment.sample_width == 1:
+        # Pydub stores 8-bit audio as signed integers, but WAV files store them as unsigned integers
+        pcm_data = (np.frombuffer(pcm_data, dtype=np.uint8) ^ 0x80).tobytes()
+
+    # Write the PCM data straight into the WAV file
+    with wave.open(f"{filename}.wav", "wb") as f:
+        f.setnchannels(audiosegment.channels)
+        f.setsampwidth(audiosegment.sample_width)
+        f.setframerate(audiosegment.frame_rate)
+        f.writeframes(pcm_data)
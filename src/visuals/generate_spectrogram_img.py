@@ -2,7 +2,7 @@
 generate_spectrogram_img.py
 
 Created on 2021-11-16
-Updated on 2022-02-04
+Updated on 2026-10-15
 
 Copyright © Ryan Kan
 
@@ -10,22 +10,137 @@ Description: Code that generates a spectrogram image.
 """
 
 # IMPORTS
-import io
 import math
-from typing import Optional
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+from typing import Optional, Tuple
 
 import numpy as np
-import plotly.graph_objects as go
 from PIL import Image
-from tqdm import trange
+from plotly.colors import hex_to_rgb, sequential
+from tqdm import tqdm
 
 from src.misc import NOTE_NUMBER_RANGE, note_number_to_freq
 
+# CONSTANTS
+# Lookup table that maps a colour index in the interval [0, 255] to an RGB triplet of the Viridis colour scale
+_VIRIDIS_COLOURS = np.array([hex_to_rgb(colour) for colour in sequential.Viridis], dtype=float)
+VIRIDIS_LUT = np.stack([
+    np.interp(np.linspace(0, 1, 256), np.linspace(0, 1, len(_VIRIDIS_COLOURS)), _VIRIDIS_COLOURS[:, i])
+    for i in range(3)
+], axis=1).round().astype(np.uint8)
+
+
+# HELPER FUNCTIONS
+def _get_row_indices(frequencies: np.ndarray, img_height: int) -> np.ndarray:
+    """
+    Gets the index of the frequency bin that each pixel row of the image falls in.
+
+    The rows are spaced evenly on a log scale spanning the notes in `NOTE_NUMBER_RANGE`, with the highest frequency at
+    the top of the image.
+
+    Args:
+        frequencies:
+            Array of sample frequencies. This must be sorted in ascending order.
+
+        img_height:
+            Height of the image, in pixels.
+
+    Returns:
+        np.ndarray:
+            Array of length `img_height` containing the frequency bin index of each row.
+    """
+
+    # Calculate the range for the log scale
+    log_freq_min = math.log10(note_number_to_freq(NOTE_NUMBER_RANGE[0]))
+    log_freq_max = math.log10(note_number_to_freq(NOTE_NUMBER_RANGE[1]))
+
+    # Get the log frequency at the centre of each row, starting from the top
+    row_log_freqs = log_freq_max - (np.arange(img_height) + 0.5) / img_height * (log_freq_max - log_freq_min)
+
+    # Each frequency bin spans halfway to its neighbours on the log scale
+    log_freqs = np.log10(frequencies)
+    bin_edges = (log_freqs[1:] + log_freqs[:-1]) / 2
+
+    return np.searchsorted(bin_edges, row_log_freqs)
+
+
+def _downsample_columns(spectrogram: np.ndarray, times: np.ndarray, num_columns: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Downsamples the spectrogram along the time axis by averaging groups of neighbouring columns.
+
+    Args:
+        spectrogram:
+            Matrix of short-term Fourier transform coefficients, i.e. the spectrogram data.
+
+        times:
+            Array of sample times.
+
+        num_columns:
+            Number of columns to downsample to.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]:
+            Double containing the downsampled spectrogram and its array of sample times in that order.
+    """
+
+    # Split the columns into groups of (almost) equal size
+    group_starts = np.linspace(0, len(times), num_columns, endpoint=False).astype(int)
+    group_sizes = np.diff(np.append(group_starts, len(times)))
+
+    # Average each group of columns, along with their times
+    spectrogram = np.add.reduceat(spectrogram, group_starts, axis=1)
+    spectrogram /= group_sizes
+
+    times = np.add.reduceat(times, group_starts) / group_sizes
+
+    return spectrogram, times
+
+
+def _render_batch(needed_spectrogram: np.ndarray, row_indices: np.ndarray, spectrogram_min: float,
+                  colour_scale: float, out: np.ndarray):
+    """
+    Renders one batch of the spectrogram into its section of the image.
+
+    Args:
+        needed_spectrogram:
+            Section of the spectrogram matrix for this batch.
+
+        row_indices:
+            Frequency bin index of each pixel row of the image. Can be obtained by using `_get_row_indices`.
+
+        spectrogram_min:
+            Lower bound of the colour domain.
+
+        colour_scale:
+            Factor that maps the colour domain onto the interval [0, 255].
+
+        out:
+            Section of the image array to write the batch into. Its width determines the width of the rendered batch.
+    """
+
+    # Nothing to render if the batch takes up no pixels
+    height, width, _ = out.shape
+
+    if width == 0:
+        return
+
+    # Pick out the frequency bin for each pixel row
+    needed_rows = needed_spectrogram[row_indices]
+
+    # Map the values onto the colour scale
+    colour_indices = np.clip((needed_rows - spectrogram_min) * colour_scale, 0, 255).astype(np.uint8)
+    rgb = VIRIDIS_LUT[colour_indices]
+
+    # Stretch the batch to the required width and write it into the image
+    out[:] = np.asarray(Image.fromarray(rgb).resize((width, height), Image.BILINEAR))
+
 
 # FUNCTIONS
 def generate_spectrogram_img(spectrogram: np.ndarray, frequencies: np.ndarray, times: np.ndarray, duration: float,
                              progress: Optional[list] = None, batch_size: int = 32, px_per_second: int = 50,
-                             img_height=720) -> Image.Image:
+                             img_height=720, workers: Optional[int] = None) -> Image.Image:
     """
     Generates a spectrogram image.
 
@@ -45,7 +160,8 @@ def generate_spectrogram_img(spectrogram: np.ndarray, frequencies: np.ndarray, t
         progress:
             List object to share the spectrogram generation process with other threads.
             A list is used instead of a standard tuple to utilise address assignment of lists, and so the data can be
-            shared across threads.
+            shared across threads. A managed list (e.g. from `multiprocessing.Manager`) can be used to share it across
+            processes; to keep that cheap, the progress is only updated about 100 times in total.
 
         batch_size:
             Size of each batch when generating each image.
@@ -56,11 +172,21 @@ def generate_spectrogram_img(spectrogram: np.ndarray, frequencies: np.ndarray, t
         img_height:
             Height of the image, in pixels.
 
+        workers:
+            Number of threads to render the batches with. Defaults to the number of CPUs.
+
     Returns:
         Image.Image:
             Pillow image, representing the generated spectrogram.
     """
 
+    # Average away any columns beyond what the image has pixels for; keep at least two batches' worth of columns, as
+    # the last two batches get joined into one
+    num_columns = max(round(duration * px_per_second), 2 * batch_size)
+
+    if len(times) > 1.5 * num_columns:
+        spectrogram, times = _downsample_columns(spectrogram, times, num_columns)
+
     # Get the number of samples
     num_samples = len(times)
 
@@ -71,91 +197,60 @@ def generate_spectrogram_img(spectrogram: np.ndarray, frequencies: np.ndarray, t
     spectrogram_min = np.amin(spectrogram)
     spectrogram_max = np.amax(spectrogram)
 
+    # Calculate the factor that maps the colour domain onto the colour scale
+    if spectrogram_max > spectrogram_min:
+        colour_scale = 255 / (spectrogram_max - spectrogram_min)
+    else:
+        colour_scale = 0
+
+    # Find the frequency bin of each row of the image
+    row_indices = _get_row_indices(frequencies, img_height)
+
     # Calculate the number of batches needed
     num_batches = math.ceil(num_samples / batch_size) - 1  # Minus one because we need to join the last two batches
 
-    # Determine what iterable to use
-    if progress is None:
-        iterable = trange(num_batches, desc="Iterating through batches")
-    else:
-        iterable = range(num_batches)
-
-    # Generate all images
-    images = []
-
-    for batch_no in iterable:
-        # Get the length of the audio
-        if batch_no != num_batches - 1:  # Not last batch
-            audio_length = times[(batch_no + 1) * batch_size] - times[batch_no * batch_size]
-        else:
-            audio_length = times[-1] - times[(num_batches - 1) * batch_size]
-
-        # Get the times and spectrogram section
-        if batch_no != num_batches - 1:  # Not last batch
-            needed_time = times[batch_no * batch_size: (batch_no + 1) * batch_size]
-            needed_spectrogram = spectrogram[:, batch_no * batch_size: (batch_no + 1) * batch_size]
-        else:
-            needed_time = times[(num_batches - 1) * batch_size:]
-            needed_spectrogram = spectrogram[:, (num_batches - 1) * batch_size:]
-
-        # Calculate the range for the log plot
-        spectrogram_range = [
-            math.log10(note_number_to_freq(NOTE_NUMBER_RANGE[0])),
-            math.log10(note_number_to_freq(NOTE_NUMBER_RANGE[1]))
-        ]
-
-        # Plot the spectrogram
-        fig = go.Figure(data=go.Heatmap(
-            z=needed_spectrogram,
-            x=needed_time,
-            y=frequencies,
-            zmin=spectrogram_min,  # Note to self: `zmin` is lower bound of colour domain
-            zmax=spectrogram_max,  # Note to self: `zmax` is upper bound of colour domain
-            colorscale="Viridis"))
-
-        fig.update_xaxes(visible=False, showticklabels=False)
-        fig.update_yaxes(type="log", visible=False, showticklabels=False, range=spectrogram_range)
-        fig.update_traces(showscale=False)
-
-        fig.update_layout(
-            autosize=False,
-            width=int(audio_length * px_per_second),
-            height=img_height,
-            margin=dict(l=0, r=0, b=0, t=0, pad=0)
-        )
-
-        # Save the spectrogram to the image buffer
-        img_buf = io.BytesIO()
-        fig.write_image(img_buf, format="png")
-
-        # Open the image buffer in Pillow
-        img = Image.open(img_buf)
-
-        # Append the generated image to the list of all images
-        images.append(img)
-
-        # Update the progress, if required
-        if progress is not None:
-            progress[0] = (batch_no, num_batches)  # Set the only element in the list to be the progress
-
-    # Get the combined length of all images
-    combined_length = 0
-    for img in images:
-        combined_length += img.width
-
-    # Merge all images into one giant image
-    final_img = Image.new("RGB", (combined_length, img_height))
-    curr_length = 0  # Used for determination on where to paste the image
-
-    for i, img in enumerate(images):
-        final_img.paste(img, box=(curr_length, 0))  # Note that the uppermost edge is 0
-        curr_length += img.width
-
-    # Now resize the image to fit the duration
-    final_img = final_img.resize((round(duration * px_per_second), img_height))
-
-    # Return the pillow image
-    return final_img
+    # Assert that there is at least one batch to render
+    assert num_batches >= 1, f"Need more than {batch_size} samples to render a batch, but only have {num_samples}."
+
+    # Get the column at which each batch starts; the last batch runs to the end of the spectrogram
+    batch_columns = np.append(np.arange(num_batches) * batch_size, num_samples)
+
+    # Get the time at which each batch starts, along with the end time of the last batch
+    batch_times = times[np.append(batch_columns[:-1], -1)]
+
+    # Get the pixel offset of each batch so that every batch knows exactly where it goes in the image; the batches are
+    # stretched so that the image fits the duration
+    img_width = round(duration * px_per_second)
+    batch_fractions = (batch_times - batch_times[0]) / (batch_times[-1] - batch_times[0])
+    px_offsets = np.round(batch_fractions * img_width).astype(int)
+
+    # Pre-allocate the image that every batch is written into
+    canvas = np.empty((img_height, img_width, 3), dtype=np.uint8)
+
+    # Split the spectrogram and the image into batches
+    needed_spectrograms = [spectrogram[:, start:end] for start, end in zip(batch_columns[:-1], batch_columns[1:])]
+    needed_canvases = [canvas[:, start:end] for start, end in zip(px_offsets[:-1], px_offsets[1:])]
+
+    # Only update the progress every `progress_stride` batches, as each update may have to be sent to another process
+    progress_stride = max(1, num_batches // 100)
+
+    # Generate all batches in parallel; the batches are independent of one another
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        rendered_batches = executor.map(_render_batch, needed_spectrograms, repeat(row_indices),
+                                        repeat(spectrogram_min), repeat(colour_scale), needed_canvases)
+
+        # Determine what iterable to use
+        if progress is None:
+            rendered_batches = tqdm(rendered_batches, desc="Iterating through batches", total=num_batches)
+
+        # Results arrive in submission order
+        for batch_no, _ in enumerate(rendered_batches):
+            # Update the progress, if required
+            if progress is not None and (batch_no % progress_stride == 0 or batch_no == num_batches - 1):
+                progress[0] = (batch_no, num_batches)  # Set the only element in the list to be the progress
+
+    # Wrap the image array in a Pillow image and return it
+    return Image.fromarray(canvas)
 
 
 # TESTING CODE